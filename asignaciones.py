@@ -0,0 +1,436 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, extract, func, inspect
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+
+from catalogo import coordenadas_de_ruta
+from database import engine
+from locks import lock_archivo
+from models import RondaAsignada, RondasAsignadasSnapshot, RutaCoordenada
+from schemas import RondaAsignadaResponse, RondaCoordenadaResponse
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se revisan cambios en Ronda_asignada y Ruta_coordenadas (segundos)
+SNAPSHOT_INTERVALO = float(os.getenv("SNAPSHOT_INTERVALO", "10"))
+
+# Lock para que un solo worker genere los snapshots
+SNAPSHOT_LOCK_PATH = os.getenv(
+    "SNAPSHOT_LOCK_PATH",
+    os.path.join(tempfile.gettempdir(), "api_rondas_asignaciones.lock"),
+)
+
+# Firmas de la última revisión (JSON) compartidas por los workers;
+# su mtime indica cuándo se revisó por última vez
+SNAPSHOT_MARCA_PATH = SNAPSHOT_LOCK_PATH + ".ultima"
+
+# Error de MySQL para una tabla que no existe (ER_NO_SUCH_TABLE)
+_MYSQL_TABLA_INEXISTENTE = 1146
+
+# None: aún no se sabe; False: falta crear la tabla con el script de la BD
+_tabla_disponible: Optional[bool] = None
+
+
+def _coordenadas_por_ruta(
+    session: Session, ids_ruta: Iterable[int]
+) -> Dict[int, List[Tuple[int, int]]]:
+    """
+    (id_coordenada_admin, orden) de cada ruta, leídos directo de Ruta_coordenadas
+    El snapshot se guarda para todo el día, no puede depender del catálogo en caché
+    """
+    ids_ruta = set(ids_ruta)
+    if not ids_ruta:
+        return {}
+
+    statement = (
+        select(RutaCoordenada)
+        .where(RutaCoordenada.id_ruta.in_(ids_ruta))
+        .order_by(RutaCoordenada.id_ruta, RutaCoordenada.orden)
+    )
+    coordenadas: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for rc in session.exec(statement).all():
+        coordenadas[rc.id_ruta].append((rc.id_coordenada_admin, rc.orden))
+    return coordenadas
+
+
+def _serializar_rondas(
+    rondas: List[RondaAsignada], coordenadas: Dict[int, List[Tuple[int, int]]]
+) -> List[dict]:
+    """
+    Convierte rondas asignadas al formato que espera Flutter
+    """
+    rondas_response = []
+    for ronda in rondas:
+        # Obtener coordenadas de la ruta
+        coordenadas_ronda = [
+            RondaCoordenadaResponse(id_coordenada_admin=id_coordenada, orden=orden)
+            for id_coordenada, orden in coordenadas.get(ronda.id_ruta, [])
+        ]
+
+        # Formatear fechas para Flutter
+        fecha_str = ronda.fecha_de_ejecucion.strftime("%Y-%m-%d")
+        hora_str = f"{fecha_str}T{ronda.hora_de_ejecucion.strftime('%H:%M:%S')}"
+
+        rondas_response.append(
+            RondaAsignadaResponse(
+                id_ronda_asignada=ronda.id_ronda_asignada,
+                id_tipo=ronda.id_tipo,
+                id_usuario=ronda.id_usuario,
+                fecha_de_ejecucion=fecha_str,
+                hora_de_ejecucion=hora_str,
+                distancia_permitida=(
+                    float(ronda.distancia_permitida)
+                    if ronda.distancia_permitida
+                    else 50.0
+                ),
+                coordenadas=coordenadas_ronda,
+            ).model_dump()
+        )
+
+    return rondas_response
+
+
+def calcular_rondas_asignadas(
+    session: Session, id_usuario: int, hoy: Optional[date] = None
+) -> List[dict]:
+    """
+    Calcula en vivo las rondas asignadas de un usuario (hoy y mañana)
+    """
+    hoy = hoy or date.today()
+    manana = hoy + timedelta(days=1)
+
+    statement = select(RondaAsignada).where(
+        RondaAsignada.id_usuario == id_usuario,
+        RondaAsignada.fecha_de_ejecucion.in_([hoy, manana]),
+    )
+    rondas = session.exec(statement).all()
+    # Del mismo catálogo del que login sirve coordenadas_admin
+    coordenadas = {
+        id_ruta: coordenadas_de_ruta(session, id_ruta)
+        for id_ruta in {ronda.id_ruta for ronda in rondas}
+    }
+    return _serializar_rondas(rondas, coordenadas)
+
+
+def _tabla_inexistente(error: Exception) -> bool:
+    original = getattr(error, "orig", error)
+    return (
+        getattr(original, "errno", None) == _MYSQL_TABLA_INEXISTENTE
+        # SQLite no tiene código propio para este error
+        or "no such table" in str(original).lower()
+    )
+
+
+def leer_rondas_asignadas(
+    session: Session, id_usuario: int, hoy: Optional[date] = None
+) -> List[dict]:
+    """
+    Rondas asignadas de hoy y mañana desde el snapshot del día
+    Si el usuario no tiene snapshot (o la tabla no existe) se calculan en vivo
+    """
+    global _tabla_disponible
+    hoy = hoy or date.today()
+
+    if _tabla_disponible is not False:
+        try:
+            snapshot = session.get(RondasAsignadasSnapshot, (id_usuario, hoy))
+            if snapshot is not None:
+                return json.loads(snapshot.payload)
+        except (OperationalError, ProgrammingError) as e:
+            session.rollback()
+            # Solo una tabla inexistente desactiva el snapshot; otros errores
+            # (timeouts, conexión) afectan únicamente a esta consulta
+            if _tabla_inexistente(e):
+                _tabla_disponible = False
+            logger.warning(
+                "No se pudo leer rondas_asignadas_snapshot, "
+                f"se calcula en vivo: {e.orig}"
+            )
+
+    return calcular_rondas_asignadas(session, id_usuario, hoy)
+
+
+def _firmas_usuarios(session: Session, hoy: date) -> Dict[int, str]:
+    """
+    Firma de las rondas asignadas de hoy y mañana de cada usuario: conteo y
+    sumas ponderadas por id calculadas en la BD (una fila por usuario)
+    """
+    manana = hoy + timedelta(days=1)
+    id_ronda = RondaAsignada.id_ronda_asignada
+    hora = RondaAsignada.hora_de_ejecucion
+    segundos = (
+        extract("hour", hora) * 3600
+        + extract("minute", hora) * 60
+        + extract("second", hora)
+    )
+
+    statement = (
+        select(
+            RondaAsignada.id_usuario,
+            func.count(id_ronda),
+            func.sum(id_ronda),
+            func.sum(id_ronda * RondaAsignada.id_ruta),
+            func.sum(id_ronda * RondaAsignada.id_tipo),
+            func.sum(id_ronda * extract("day", RondaAsignada.fecha_de_ejecucion)),
+            func.sum(id_ronda * segundos),
+            func.sum(id_ronda * RondaAsignada.distancia_permitida),
+        )
+        .where(RondaAsignada.fecha_de_ejecucion.in_([hoy, manana]))
+        .group_by(RondaAsignada.id_usuario)
+    )
+    return {
+        fila[0]: "|".join(str(valor) for valor in fila[1:])
+        for fila in session.exec(statement).all()
+    }
+
+
+def _firmas_rutas(session: Session) -> Dict[int, str]:
+    """
+    Firma de los puntos de cada ruta en Ruta_coordenadas (una fila por ruta)
+    """
+    id_coordenada = RutaCoordenada.id_coordenada_admin
+    statement = select(
+        RutaCoordenada.id_ruta,
+        func.count(id_coordenada),
+        func.sum(id_coordenada),
+        func.sum(RutaCoordenada.orden),
+        func.sum(id_coordenada * RutaCoordenada.orden),
+    ).group_by(RutaCoordenada.id_ruta)
+    return {
+        fila[0]: "|".join(str(valor) for valor in fila[1:])
+        for fila in session.exec(statement).all()
+    }
+
+
+def _cambiados(anteriores: Dict[str, str], actuales: Dict[int, str]) -> Set[int]:
+    """
+    Ids cuya firma cambió, apareció o desapareció
+    Las claves de anteriores son texto porque vienen del JSON
+    """
+    ids = set(actuales) | {int(clave) for clave in anteriores}
+    return {id_ for id_ in ids if actuales.get(id_) != anteriores.get(str(id_))}
+
+
+def generar_snapshots(
+    session: Session, hoy: Optional[date] = None, usuarios: Optional[Set[int]] = None
+) -> int:
+    """
+    Materializa el payload de rondas asignadas de hoy de cada usuario, o solo
+    de los usuarios indicados
+    Solo escribe las filas que cambiaron; retorna cuántas se escribieron
+    """
+    hoy = hoy or date.today()
+    manana = hoy + timedelta(days=1)
+
+    statement = (
+        select(RondaAsignada)
+        .where(RondaAsignada.fecha_de_ejecucion.in_([hoy, manana]))
+        .order_by(RondaAsignada.id_usuario, RondaAsignada.id_ronda_asignada)
+    )
+    existentes_statement = select(RondasAsignadasSnapshot).where(
+        RondasAsignadasSnapshot.fecha == hoy
+    )
+    if usuarios is not None:
+        statement = statement.where(RondaAsignada.id_usuario.in_(usuarios))
+        existentes_statement = existentes_statement.where(
+            RondasAsignadasSnapshot.id_usuario.in_(usuarios)
+        )
+
+    rondas = session.exec(statement).all()
+    coordenadas = _coordenadas_por_ruta(session, (r.id_ruta for r in rondas))
+
+    por_usuario: Dict[int, List[RondaAsignada]] = defaultdict(list)
+    for ronda in rondas:
+        por_usuario[ronda.id_usuario].append(ronda)
+
+    existentes = {
+        snapshot.id_usuario: snapshot
+        for snapshot in session.exec(existentes_statement).all()
+    }
+
+    escritos = 0
+    # Usuarios con rondas, y los que ya tenían snapshot (pudieron quedarse sin rondas)
+    for id_usuario in set(por_usuario) | set(existentes):
+        payload = json.dumps(
+            _serializar_rondas(por_usuario.get(id_usuario, []), coordenadas)
+        )
+
+        snapshot = existentes.get(id_usuario)
+        if snapshot is not None and snapshot.payload == payload:
+            continue
+
+        if snapshot is None:
+            snapshot = RondasAsignadasSnapshot(id_usuario=id_usuario, fecha=hoy)
+        snapshot.payload = payload
+        snapshot.fecha_generacion = datetime.now()
+        session.add(snapshot)
+        escritos += 1
+
+    # Los snapshots de días anteriores ya no se leen
+    if usuarios is None:
+        session.execute(
+            delete(RondasAsignadasSnapshot).where(RondasAsignadasSnapshot.fecha < hoy)
+        )
+    session.commit()
+
+    return escritos
+
+
+def _generacion_reciente() -> bool:
+    """
+    Indica si otro worker ya revisó los snapshots de hoy dentro del intervalo
+    """
+    try:
+        ultima = os.stat(SNAPSHOT_MARCA_PATH).st_mtime
+    except FileNotFoundError:
+        return False
+
+    return (
+        date.fromtimestamp(ultima) == date.today()
+        and time.time() - ultima < SNAPSHOT_INTERVALO * 0.9
+    )
+
+
+def _leer_estado() -> dict:
+    try:
+        with open(SNAPSHOT_MARCA_PATH, encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _guardar_estado(estado: dict) -> None:
+    directorio = os.path.dirname(os.path.abspath(SNAPSHOT_MARCA_PATH))
+    fd, tmp_path = tempfile.mkstemp(dir=directorio, prefix=".asignaciones-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as archivo:
+            json.dump(estado, archivo)
+        os.replace(tmp_path, SNAPSHOT_MARCA_PATH)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _actualizar(session: Session, hoy: date, forzar: bool) -> int:
+    """
+    Revisa las firmas y regenera lo que cambió; retorna cuántas filas escribió
+
+    La generación completa solo se hace al cambiar el día (medianoche), la
+    primera vez o si se fuerza. Después solo se regeneran los usuarios cuyas
+    rondas cambiaron o que tienen rondas en una ruta cuyos puntos cambiaron
+    """
+    estado = {} if forzar else _leer_estado()
+    firmas_usuarios = _firmas_usuarios(session, hoy)
+    firmas_rutas = _firmas_rutas(session)
+
+    if estado.get("fecha") != hoy.isoformat():
+        usuarios = None
+    else:
+        usuarios = _cambiados(estado.get("usuarios", {}), firmas_usuarios)
+        rutas = _cambiados(estado.get("rutas", {}), firmas_rutas)
+        if rutas:
+            statement = select(RondaAsignada.id_usuario).where(
+                RondaAsignada.fecha_de_ejecucion.in_([hoy, hoy + timedelta(days=1)]),
+                RondaAsignada.id_ruta.in_(rutas),
+            )
+            usuarios.update(session.exec(statement).all())
+
+    escritos = 0
+    if usuarios is None or usuarios:
+        escritos = generar_snapshots(session, hoy, usuarios)
+
+    _guardar_estado(
+        {
+            "fecha": hoy.isoformat(),
+            "usuarios": {str(id_): firma for id_, firma in firmas_usuarios.items()},
+            "rutas": {str(id_): firma for id_, firma in firmas_rutas.items()},
+        }
+    )
+    return escritos
+
+
+def ejecutar_generacion(forzar: bool = False) -> bool:
+    """
+    Revisa cambios y actualiza los snapshots si ningún otro worker lo está
+    haciendo ni lo hizo hace poco
+    """
+    global _tabla_disponible
+
+    # Cada worker revisa la tabla para dejar de calcular en vivo cuando se cree
+    disponible = inspect(engine).has_table(RondasAsignadasSnapshot.__tablename__)
+    if not disponible:
+        if _tabla_disponible is not False:
+            logger.warning(
+                "Falta la tabla rondas_asignadas_snapshot (ver script de la BD); "
+                "las rondas asignadas se calculan en vivo"
+            )
+        _tabla_disponible = False
+        return False
+    _tabla_disponible = True
+
+    with lock_archivo(SNAPSHOT_LOCK_PATH) as adquirido:
+        if not adquirido or (not forzar and _generacion_reciente()):
+            return False
+
+        with Session(engine) as session:
+            escritos = _actualizar(session, date.today(), forzar)
+
+        if escritos:
+            logger.info(f"Snapshots de rondas asignadas actualizados: {escritos}")
+        return True
+
+
+def _segundos_a_medianoche() -> float:
+    ahora = datetime.now()
+    medianoche = datetime.combine(
+        ahora.date() + timedelta(days=1), datetime.min.time()
+    )
+    return (medianoche - ahora).total_seconds()
+
+
+async def _programar() -> None:
+    while True:
+        try:
+            await run_in_threadpool(ejecutar_generacion)
+        except Exception as e:
+            logger.error(f"Error al generar snapshots: {str(e)}", exc_info=True)
+
+        # Despertar a medianoche aunque no haya pasado el intervalo completo
+        await asyncio.sleep(min(SNAPSHOT_INTERVALO, _segundos_a_medianoche() + 1))
+
+
+_tarea: Optional[asyncio.Task] = None
+
+
+def iniciar() -> None:
+    global _tarea
+    if _tarea is None:
+        _tarea = asyncio.create_task(_programar())
+
+
+async def detener() -> None:
+    global _tarea
+    if _tarea is not None:
+        _tarea.cancel()
+        try:
+            await _tarea
+        except asyncio.CancelledError:
+            pass
+        _tarea = None
+
+
+if __name__ == "__main__":
+    # Regeneración completa manual: python asignaciones.py
+    logging.basicConfig(level=logging.INFO)
+    if not ejecutar_generacion(forzar=True):
+        logger.warning("No se generaron los snapshots (otro proceso o falta la tabla)")
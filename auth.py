@@ -1,25 +1,17 @@
 import logging
-from datetime import date, timedelta
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
 
-from database import get_session
-from models import (
-    CoordenadaAdmin,
-    RondaAsignada,
-    RutaCoordenada,
-    TipoRonda,
-    TipoUsuario,
-    Usuario,
-)
+from asignaciones import leer_rondas_asignadas
+from catalogo import listar_coordenadas
+from database import get_read_session
+from models import TipoRonda, TipoUsuario, Usuario
 from schemas import (
     CoordenadaAdminResponse,
     LoginRequest,
     LoginResponse,
-    RondaAsignadaResponse,
-    RondaCoordenadaResponse,
     TipoRondaResponse,
     TipoUsuarioResponse,
     UsuarioResponse,
@@ -31,9 +23,10 @@ logger = logging.getLogger(__name__)
 
 
 @router.post("/login", response_model=LoginResponse)
-def login(request: LoginRequest, session: Session = Depends(get_session)):
+def login(request: LoginRequest, session: Session = Depends(get_read_session)):
     """
     Autentica al usuario y retorna sus datos + rondas asignadas (hoy y mañana)
+    Solo lectura: usa la réplica salvo que el cliente envíe X-Ultima-Escritura reciente
     """
     try:
         # 1. VALIDAR USUARIO
@@ -71,73 +64,33 @@ def login(request: LoginRequest, session: Session = Depends(get_session)):
             for tr in tipos_ronda
         ]
 
-        # 3. OBTENER COORDENADAS ADMIN
-        coordenadas = session.exec(select(CoordenadaAdmin)).all()
-        coordenadas_response = []
-
-        for coord in coordenadas:
-            coord_data = CoordenadaAdminResponse(
-                id_coordenada_admin=coord.id_coordenada_admin,
-                latitud=float(coord.latitud) if coord.latitud is not None else None,
-                longitud=float(coord.longitud) if coord.longitud is not None else None,
-                nombre_coordenada=coord.nombre_coordenada,
-                codigo_qr=coord.codigo_qr,
-            )
-            coordenadas_response.append(coord_data)
-
-        # 4. OBTENER RONDAS ASIGNADAS (HOY Y MAÑANA)
-        hoy = date.today()
-        manana = hoy + timedelta(days=1)
-
-        statement = select(RondaAsignada).where(
-            RondaAsignada.id_usuario == usuario.id_usuario,
-            RondaAsignada.fecha_de_ejecucion.in_([hoy, manana]),
-        )
-        rondas_asignadas = session.exec(statement).all()
-
-        # 5. TRANSFORMAR RUTAS
-        rondas_response = []
-        for ronda in rondas_asignadas:
-            # Obtener coordenadas de la ruta
-            statement = (
-                select(RutaCoordenada)
-                .where(RutaCoordenada.id_ruta == ronda.id_ruta)
-                .order_by(RutaCoordenada.orden)
-            )
-
-            ruta_coordenadas = session.exec(statement).all()
-
-            coordenadas_ronda = [
-                RondaCoordenadaResponse(
-                    id_coordenada_admin=rc.id_coordenada_admin, orden=rc.orden
-                )
-                for rc in ruta_coordenadas
-            ]
-
-            # Formatear fechas para Flutter
-            fecha_str = ronda.fecha_de_ejecucion.strftime("%Y-%m-%d")
-            hora_str = f"{fecha_str}T{ronda.hora_de_ejecucion.strftime('%H:%M:%S')}"
-
-            rondas_response.append(
-                RondaAsignadaResponse(
-                    id_ronda_asignada=ronda.id_ronda_asignada,
-                    id_tipo=ronda.id_tipo,
-                    id_usuario=ronda.id_usuario,
-                    fecha_de_ejecucion=fecha_str,
-                    hora_de_ejecucion=hora_str,
-                    distancia_permitida=(
-                        float(ronda.distancia_permitida)
-                        if ronda.distancia_permitida
-                        else 50.0
-                    ),
-                    coordenadas=coordenadas_ronda,
-                )
-            )
+        # 3. OBTENER RONDAS ASIGNADAS (HOY Y MAÑANA) - snapshot precalculado
+        rondas_response = leer_rondas_asignadas(session, usuario.id_usuario)
 
         logger.info(
             f"Usuario {usuario.id_usuario} obtuvo {len(rondas_response)} rondas asignadas"
         )
 
+        # 4. OBTENER COORDENADAS ADMIN (snapshot compartido entre workers)
+        # Deben incluir todos los puntos que referencian las rondas asignadas
+        requeridas = {
+            coordenada["id_coordenada_admin"]
+            for ronda in rondas_response
+            for coordenada in ronda["coordenadas"]
+        }
+        coordenadas_response = [
+            CoordenadaAdminResponse(
+                id_coordenada_admin=id_coordenada,
+                latitud=latitud,
+                longitud=longitud,
+                nombre_coordenada=nombre,
+                codigo_qr=codigo_qr,
+            )
+            for id_coordenada, latitud, longitud, nombre, codigo_qr in (
+                listar_coordenadas(session, requeridas)
+            )
+        ]
+
         # 6. CONSTRUIR RESPUESTA
         return LoginResponse(
             usuario=UsuarioResponse(
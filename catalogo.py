@@ -0,0 +1,458 @@
+import asyncio
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+
+from database import read_engine
+from locks import lock_archivo
+from models import CoordenadaAdmin, RutaCoordenada
+
+logger = logging.getLogger(__name__)
+
+# Puntero a la versión vigente (y su huella), compartido por todos los workers
+# del servidor. Cada versión se escribe en "<CATALOGO_PATH>.<versión>"
+CATALOGO_PATH = os.getenv(
+    "CATALOGO_PATH", os.path.join(tempfile.gettempdir(), "api_rondas_catalogo.bin")
+)
+
+# Antigüedad máxima del snapshot antes de reconstruirlo (segundos)
+CATALOGO_TTL = float(os.getenv("CATALOGO_TTL", "300"))
+
+# Cada cuánto un worker revisa si hay una versión nueva del archivo (segundos)
+CATALOGO_CHECK_SECONDS = float(os.getenv("CATALOGO_CHECK_SECONDS", "1"))
+
+# Cada cuánto la tarea de fondo revisa si la BD cambió o el snapshot venció (segundos)
+CATALOGO_REVISION_SECONDS = float(os.getenv("CATALOGO_REVISION_SECONDS", "10"))
+
+# Formato binario (little-endian):
+#   cabecera | coordenadas (ordenadas por id) | rutas (ordenadas por id) |
+#   pares (id_coordenada, orden) de cada ruta | textos UTF-8
+_MAGIC = b"RONDCAT1"
+_CABECERA = struct.Struct("<8sQIIII")  # magic, versión, n_coord, n_rutas, n_pares, bytes_texto
+_COORDENADA = struct.Struct("<qddIIII")  # id, lat, lon, nombre_off, nombre_len, qr_off, qr_len
+_RUTA = struct.Struct("<qII")  # id_ruta, primer par, cantidad de pares
+_PAR = struct.Struct("<qq")  # id_coordenada_admin, orden
+_SIN_TEXTO = 0xFFFFFFFF
+
+CoordenadaCatalogo = Tuple[int, Optional[float], Optional[float], str, Optional[str]]
+
+
+class Catalogo:
+    """
+    Vista de solo lectura sobre el snapshot mapeado en memoria
+    Las páginas las comparte el sistema operativo entre todos los workers
+    """
+
+    def __init__(self, archivo: mmap.mmap):
+        self._mmap = archivo
+        self._buffer = memoryview(archivo)
+
+        magic, version, n_coord, n_rutas, n_pares, _ = _CABECERA.unpack_from(
+            self._buffer, 0
+        )
+        if magic != _MAGIC:
+            raise ValueError("Archivo de catálogo inválido")
+
+        self.version = version
+        self.n_coordenadas = n_coord
+        self.n_rutas = n_rutas
+        self._inicio_coord = _CABECERA.size
+        self._inicio_rutas = self._inicio_coord + n_coord * _COORDENADA.size
+        self._inicio_pares = self._inicio_rutas + n_rutas * _RUTA.size
+        self._inicio_texto = self._inicio_pares + n_pares * _PAR.size
+
+    def _texto(self, offset: int, longitud: int) -> Optional[str]:
+        if longitud == _SIN_TEXTO:
+            return None
+        inicio = self._inicio_texto + offset
+        return str(self._buffer[inicio : inicio + longitud], "utf-8")
+
+    def _coordenada(self, indice: int) -> CoordenadaCatalogo:
+        id_coord, lat, lon, n_off, n_len, qr_off, qr_len = _COORDENADA.unpack_from(
+            self._buffer, self._inicio_coord + indice * _COORDENADA.size
+        )
+        return (
+            id_coord,
+            None if math.isnan(lat) else lat,
+            None if math.isnan(lon) else lon,
+            self._texto(n_off, n_len),
+            self._texto(qr_off, qr_len),
+        )
+
+    def coordenadas(self) -> Iterator[CoordenadaCatalogo]:
+        """
+        (id, latitud, longitud, nombre, codigo_qr) de cada punto, ordenados por id
+        """
+        for indice in range(self.n_coordenadas):
+            yield self._coordenada(indice)
+
+    def coordenadas_ruta(self, id_ruta: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        (id_coordenada_admin, orden) de la ruta ordenados por orden
+        None si la ruta no está en el snapshot
+        """
+        # Búsqueda binaria sobre los registros de rutas
+        bajo, alto = 0, self.n_rutas
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            id_medio, primero, cantidad = _RUTA.unpack_from(
+                self._buffer, self._inicio_rutas + medio * _RUTA.size
+            )
+            if id_medio < id_ruta:
+                bajo = medio + 1
+            elif id_medio > id_ruta:
+                alto = medio
+            else:
+                inicio = self._inicio_pares + primero * _PAR.size
+                return [
+                    _PAR.unpack_from(self._buffer, inicio + i * _PAR.size)
+                    for i in range(cantidad)
+                ]
+        return None
+
+
+def huella_catalogo(session: Session) -> str:
+    """
+    Resumen barato de Coordenadas_admin y Ruta_coordenadas: conteos y sumas
+    ponderadas por id, calculados en la BD sin leer las filas
+    No detecta un texto editado que conserve su longitud; eso lo cubre CATALOGO_TTL
+    """
+    id_coord = CoordenadaAdmin.id_coordenada_admin
+    largo_qr = func.coalesce(func.length(CoordenadaAdmin.codigo_qr), -1)
+    coordenadas = session.exec(
+        select(
+            func.count(id_coord),
+            func.max(id_coord),
+            func.sum(id_coord * CoordenadaAdmin.latitud),
+            func.sum(id_coord * CoordenadaAdmin.longitud),
+            func.sum(id_coord * func.length(CoordenadaAdmin.nombre_coordenada)),
+            func.sum(id_coord * largo_qr),
+        )
+    ).one()
+    pares = session.exec(
+        select(
+            func.count(RutaCoordenada.id_ruta),
+            func.sum(RutaCoordenada.id_ruta * RutaCoordenada.orden),
+            func.sum(RutaCoordenada.id_coordenada_admin * RutaCoordenada.orden),
+            func.sum(RutaCoordenada.id_ruta * RutaCoordenada.id_coordenada_admin),
+        )
+    ).one()
+    return "|".join(str(valor) for valor in (*coordenadas, *pares))
+
+
+def construir_catalogo(
+    session: Session, path: str = CATALOGO_PATH, huella: Optional[str] = None
+) -> int:
+    """
+    Escribe un snapshot nuevo en su propio archivo y publica su versión
+    reemplazando el puntero con os.replace (atómico)
+    El archivo mapeado nunca se reemplaza, así también funciona en Windows
+    Retorna la versión generada
+    """
+    # La huella se toma antes de leer: si algo cambia mientras tanto,
+    # la siguiente revisión ve otra huella y vuelve a publicar
+    if huella is None:
+        huella = huella_catalogo(session)
+
+    coordenadas = session.exec(
+        select(CoordenadaAdmin).order_by(CoordenadaAdmin.id_coordenada_admin)
+    ).all()
+    pares = session.exec(
+        select(RutaCoordenada).order_by(RutaCoordenada.id_ruta, RutaCoordenada.orden)
+    ).all()
+
+    texto = bytearray()
+
+    def agregar_texto(valor: Optional[str]) -> Tuple[int, int]:
+        if valor is None:
+            return 0, _SIN_TEXTO
+        datos = valor.encode("utf-8")
+        offset = len(texto)
+        texto.extend(datos)
+        return offset, len(datos)
+
+    bloque_coord = bytearray()
+    for coord in coordenadas:
+        bloque_coord += _COORDENADA.pack(
+            coord.id_coordenada_admin,
+            float(coord.latitud) if coord.latitud is not None else math.nan,
+            float(coord.longitud) if coord.longitud is not None else math.nan,
+            *agregar_texto(coord.nombre_coordenada),
+            *agregar_texto(coord.codigo_qr),
+        )
+
+    bloque_rutas = bytearray()
+    bloque_pares = bytearray()
+    ruta_actual, primero = None, 0
+    for indice, par in enumerate(pares):
+        if par.id_ruta != ruta_actual:
+            if ruta_actual is not None:
+                bloque_rutas += _RUTA.pack(ruta_actual, primero, indice - primero)
+            ruta_actual, primero = par.id_ruta, indice
+        bloque_pares += _PAR.pack(par.id_coordenada_admin, par.orden)
+    if ruta_actual is not None:
+        bloque_rutas += _RUTA.pack(ruta_actual, primero, len(pares) - primero)
+
+    version = time.time_ns()
+    cabecera = _CABECERA.pack(
+        _MAGIC,
+        version,
+        len(coordenadas),
+        len(bloque_rutas) // _RUTA.size,
+        len(pares),
+        len(texto),
+    )
+
+    _escribir_atomico(
+        f"{path}.{version}", cabecera, bloque_coord, bloque_rutas, bloque_pares, texto
+    )
+    anterior = _leer_version(path)
+    _escribir_atomico(path, f"{version}\n{huella}".encode("utf-8"))
+    _limpiar_versiones(path, conservar={version, anterior})
+
+    logger.info(
+        f"Catálogo publicado - versión {version}, "
+        f"{len(coordenadas)} coordenadas, {len(bloque_rutas) // _RUTA.size} rutas"
+    )
+    return version
+
+
+def _escribir_atomico(path: str, *bloques: bytes) -> None:
+    directorio = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directorio, prefix=".catalogo-")
+    try:
+        with os.fdopen(fd, "wb") as archivo:
+            for bloque in bloques:
+                archivo.write(bloque)
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _leer_puntero(path: str) -> Tuple[Optional[int], Optional[str]]:
+    """
+    (versión, huella) publicadas en el puntero
+    """
+    try:
+        with open(path, "rb") as archivo:
+            version, _, huella = archivo.read().decode("utf-8").partition("\n")
+        return int(version), huella or None
+    except (FileNotFoundError, ValueError):
+        return None, None
+
+
+def _leer_version(path: str) -> Optional[int]:
+    return _leer_puntero(path)[0]
+
+
+def _limpiar_versiones(path: str, conservar: set) -> None:
+    """
+    Borra versiones viejas; la anterior se conserva para los workers que
+    todavía no cambian de puntero
+    """
+    directorio, nombre = os.path.split(os.path.abspath(path))
+    for archivo in os.listdir(directorio):
+        sufijo = archivo[len(nombre) + 1 :]
+        if not archivo.startswith(nombre + ".") or not sufijo.isdigit():
+            continue
+        if int(sufijo) in conservar:
+            continue
+        try:
+            os.remove(os.path.join(directorio, archivo))
+        except OSError:
+            # En Windows no se puede borrar mientras otro worker lo tenga mapeado
+            pass
+
+
+def publicar_catalogo(path: str = CATALOGO_PATH, esperar: bool = False) -> bool:
+    """
+    Reconstruye el snapshot (nueva versión)
+    Sin esperar, retorna False si otro worker ya lo está haciendo
+    """
+    with lock_archivo(path + ".lock", esperar=esperar) as adquirido:
+        if not adquirido:
+            return False
+
+        with Session(read_engine) as session:
+            construir_catalogo(session, path)
+        return True
+
+
+def revisar_catalogo(path: str = CATALOGO_PATH) -> bool:
+    """
+    Publica una versión nueva si la huella de la BD ya no coincide con la
+    publicada o si el snapshot venció; retorna True si publicó
+    Si otro worker está revisando no hace nada
+    """
+    with lock_archivo(path + ".lock") as adquirido:
+        if not adquirido:
+            return False
+
+        with Session(read_engine) as session:
+            huella = huella_catalogo(session)
+            if huella == _leer_puntero(path)[1] and not catalogo_vencido(path):
+                return False
+
+            construir_catalogo(session, path, huella)
+        return True
+
+
+def catalogo_vencido(path: str = CATALOGO_PATH) -> bool:
+    try:
+        return time.time() - os.stat(path).st_mtime > CATALOGO_TTL
+    except FileNotFoundError:
+        return True
+
+
+def _abrir(path: str, version: int) -> Optional[Catalogo]:
+    try:
+        with open(f"{path}.{version}", "rb") as archivo:
+            datos = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    return Catalogo(datos)
+
+
+_actual: Optional[Catalogo] = None
+_ultimo_chequeo = 0.0
+_lock = threading.Lock()
+
+
+def obtener_catalogo() -> Optional[Catalogo]:
+    """
+    Snapshot vigente de este worker
+    Cambia al archivo nuevo cuando otro proceso publica una versión
+    Retorna None si no hay snapshot disponible (usar la BD)
+
+    Nunca reconstruye: solo lee el puntero y mapea; la reconstrucción la hace
+    la tarea de fondo o python catalogo.py
+    """
+    global _actual, _ultimo_chequeo
+
+    ahora = time.monotonic()
+    if _actual is not None and ahora - _ultimo_chequeo < CATALOGO_CHECK_SECONDS:
+        return _actual
+
+    with _lock:
+        if _actual is not None and ahora - _ultimo_chequeo < CATALOGO_CHECK_SECONDS:
+            return _actual
+        _ultimo_chequeo = ahora
+
+        try:
+            version = _leer_version(CATALOGO_PATH)
+
+            # El mapeo anterior se libera cuando ya nadie lo usa
+            if version is not None and (_actual is None or version != _actual.version):
+                nuevo = _abrir(CATALOGO_PATH, version)
+                if nuevo is not None:
+                    _actual = nuevo
+
+        except Exception as e:
+            logger.error(f"Error al cargar catálogo: {str(e)}", exc_info=True)
+
+        return _actual
+
+
+def listar_coordenadas(
+    session: Session, requeridas: Iterable[int] = ()
+) -> List[CoordenadaCatalogo]:
+    """
+    Todas las coordenadas admin, desde el snapshot o desde la BD
+
+    El archivo es compartido, pero cada llamada decodifica sus registros en
+    tuplas nuevas. Si al snapshot le falta alguna de las coordenadas
+    requeridas (por ejemplo las de las rondas asignadas de la misma
+    respuesta) se lee de la BD para no devolver referencias huérfanas
+    """
+    catalogo = obtener_catalogo()
+    if catalogo is not None:
+        coordenadas = list(catalogo.coordenadas())
+        faltantes = set(requeridas).difference(coord[0] for coord in coordenadas)
+        if not faltantes:
+            return coordenadas
+        logger.info(
+            f"Catálogo {catalogo.version} sin {len(faltantes)} coordenadas, se lee la BD"
+        )
+
+    coordenadas = session.exec(select(CoordenadaAdmin)).all()
+    return [
+        (
+            coord.id_coordenada_admin,
+            float(coord.latitud) if coord.latitud is not None else None,
+            float(coord.longitud) if coord.longitud is not None else None,
+            coord.nombre_coordenada,
+            coord.codigo_qr,
+        )
+        for coord in coordenadas
+    ]
+
+
+def coordenadas_de_ruta(session: Session, id_ruta: int) -> List[Tuple[int, int]]:
+    """
+    (id_coordenada_admin, orden) de una ruta, desde el snapshot o desde la BD
+    """
+    catalogo = obtener_catalogo()
+    if catalogo is not None:
+        pares = catalogo.coordenadas_ruta(id_ruta)
+        if pares is not None:
+            return pares
+
+    # Ruta creada después del último snapshot (o sin snapshot): leer de la BD
+    statement = (
+        select(RutaCoordenada)
+        .where(RutaCoordenada.id_ruta == id_ruta)
+        .order_by(RutaCoordenada.orden)
+    )
+    return [(rc.id_coordenada_admin, rc.orden) for rc in session.exec(statement).all()]
+
+
+async def _programar() -> None:
+    while True:
+        try:
+            # Solo un worker reconstruye; los demás ven el puntero ya renovado
+            await run_in_threadpool(revisar_catalogo)
+        except Exception as e:
+            logger.error(f"Error al publicar catálogo: {str(e)}", exc_info=True)
+
+        await asyncio.sleep(CATALOGO_REVISION_SECONDS)
+
+
+_tarea: Optional[asyncio.Task] = None
+
+
+def iniciar() -> None:
+    global _tarea
+    if _tarea is None:
+        _tarea = asyncio.create_task(_programar())
+
+
+async def detener() -> None:
+    global _tarea
+    if _tarea is not None:
+        _tarea.cancel()
+        try:
+            await _tarea
+        except asyncio.CancelledError:
+            pass
+        _tarea = None
+
+
+if __name__ == "__main__":
+    # Publicación inmediata sin esperar la próxima revisión: python catalogo.py
+    logging.basicConfig(level=logging.INFO)
+    publicar_catalogo(esperar=True)
@@ -1,9 +1,11 @@
 import logging
 import os
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Optional
 
 from dotenv import load_dotenv
+from fastapi import Header
+from itsdangerous import BadSignature, TimestampSigner
 from sqlalchemy import text
 from sqlmodel import Session, SQLModel, create_engine
 
@@ -22,14 +24,86 @@ if not DATABASE_URL:
         "DATABASE_URL no está configurada. Define la variable de entorno DATABASE_URL"
     )
 
-engine = create_engine(
-    DATABASE_URL,
-    echo=False,
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    pool_size=5,  # Número de conexiones en el pool
-    max_overflow=10,  # Conexiones adicionales permitidas
-)
+# Réplica de solo lectura opcional (login, consultas de rondas asignadas)
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+
+# Segundos durante los que un usuario lee del primario después de escribir,
+# para no ver datos viejos mientras la réplica se pone al día
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+# Clave con la que se firma la marca de read-your-writes
+# Debe ser la misma en todos los workers para que validen las marcas de los demás
+SECRET_KEY = os.getenv("SECRET_KEY")
+
+if DATABASE_READ_URL and not SECRET_KEY:
+    raise ValueError(
+        "SECRET_KEY no está configurada. Es necesaria cuando se usa DATABASE_READ_URL"
+    )
+
+
+def _crear_engine(url: str, pool_size: int, max_overflow: int):
+    """
+    Crea un engine con la configuración de pool común
+    """
+    connect_args = {}
+    if url.startswith("sqlite"):
+        # Permite probar localmente con archivos SQLite desde el threadpool
+        connect_args["check_same_thread"] = False
+
+    return create_engine(
+        url,
+        echo=False,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        pool_size=pool_size,  # Número de conexiones en el pool
+        max_overflow=max_overflow,  # Conexiones adicionales permitidas
+        connect_args=connect_args,
+    )
+
+
+engine = _crear_engine(DATABASE_URL, pool_size=5, max_overflow=10)
+
+if DATABASE_READ_URL:
+    read_engine = _crear_engine(
+        DATABASE_READ_URL,
+        pool_size=int(os.getenv("DATABASE_READ_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DATABASE_READ_MAX_OVERFLOW", "20")),
+    )
+else:
+    read_engine = engine
+
+# Header con el que el cliente devuelve la marca de su última escritura.
+# La marca viaja con el cliente para que cualquier worker la respete
+ULTIMA_ESCRITURA_HEADER = "X-Ultima-Escritura"
+
+
+_firmador = TimestampSigner(SECRET_KEY or "", salt="read-your-writes")
+
+
+def marca_escritura() -> str:
+    """
+    Marca firmada que se devuelve al cliente después de escribir en el primario
+    """
+    return _firmador.sign("escritura").decode("utf-8")
+
+
+def escritura_reciente(ultima_escritura: Optional[str]) -> bool:
+    """
+    Indica si la marca enviada por el cliente es válida y cae dentro
+    de la ventana de read-your-writes
+
+    La firma impide que el cliente fabrique marcas para leer siempre del
+    primario; las marcas vencidas, alteradas o con fecha futura se ignoran
+    """
+    if read_engine is engine or not ultima_escritura:
+        return False
+
+    try:
+        _firmador.unsign(ultima_escritura, max_age=READ_YOUR_WRITES_SECONDS)
+    except BadSignature:
+        return False
+
+    return True
 
 
 def get_session() -> Generator[Session, None, None]:
@@ -41,12 +115,26 @@ def get_session() -> Generator[Session, None, None]:
         yield session
 
 
-def test_connection() -> bool:
+def get_read_session(
+    x_ultima_escritura: Optional[str] = Header(default=None),
+) -> Generator[Session, None, None]:
+    """
+    Dependency para obtener sesión de solo lectura (réplica si está configurada)
+    Usa el primario si el cliente envía una marca de escritura reciente
+    No usar para escrituras
+    """
+    target_engine = engine if escritura_reciente(x_ultima_escritura) else read_engine
+
+    with Session(target_engine) as session:
+        yield session
+
+
+def test_connection(target_engine=engine) -> bool:
     """
     Prueba de conexión a la base de datos
     """
     try:
-        with Session(engine) as session:
+        with Session(target_engine) as session:
             session.exec(text("SELECT 1"))
             logger.info("Conexión a base de datos exitosa")
             return True
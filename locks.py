@@ -0,0 +1,46 @@
+import os
+import sys
+from contextlib import contextmanager
+from typing import Iterator
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def _bloquear(fd: int, esperar: bool) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK if esperar else msvcrt.LK_NBLCK, 1)
+
+    def _desbloquear(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _bloquear(fd: int, esperar: bool) -> None:
+        fcntl.flock(fd, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _desbloquear(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock_archivo(path: str, esperar: bool = False) -> Iterator[bool]:
+    """
+    Lock exclusivo entre procesos sobre un archivo (Linux y Windows)
+    Produce False si otro proceso lo tiene y no se pidió esperar
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            _bloquear(fd, esperar)
+        except OSError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            _desbloquear(fd)
+    finally:
+        os.close(fd)
@@ -4,9 +4,12 @@ import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+import asignaciones
 import auth
+import catalogo
 import rondas
-from database import test_connection
+import tracking
+from database import ULTIMA_ESCRITURA_HEADER, engine, read_engine, test_connection
 
 # Configurar logging para producción
 logging.basicConfig(
@@ -35,10 +38,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[ULTIMA_ESCRITURA_HEADER],  # Marca de read-your-writes
 )
 
 app.include_router(auth.router)
 app.include_router(rondas.router)
+app.include_router(tracking.router)
 
 
 @app.get("/")
@@ -59,11 +64,20 @@ def health_check():
     Health check para monitoreo de servicios (Render/AWS)
     """
     db_status = test_connection()
-    return {
+    response = {
         "status": "healthy" if db_status else "unhealthy",
         "database": "connected" if db_status else "disconnected",
     }
 
+    # Réplica de lectura (solo si DATABASE_READ_URL está configurada)
+    if read_engine is not engine:
+        read_status = test_connection(read_engine)
+        response["database_read"] = "connected" if read_status else "disconnected"
+        if not read_status:
+            response["status"] = "unhealthy"
+
+    return response
+
 
 @app.on_event("startup")
 def on_startup():
@@ -83,6 +97,55 @@ def on_startup():
     logger.info("=" * 50)
 
 
+@app.on_event("startup")
+async def iniciar_tracking():
+    """
+    Inicia el guardado por lotes de posiciones en vivo
+    y el cierre de rondas en vivo abandonadas
+    """
+    tracking.iniciar()
+
+
+@app.on_event("startup")
+async def iniciar_catalogo():
+    """
+    Inicia la publicación en segundo plano del catálogo compartido
+    """
+    catalogo.iniciar()
+
+
+@app.on_event("startup")
+async def iniciar_snapshots():
+    """
+    Inicia la generación programada de snapshots de rondas asignadas
+    """
+    asignaciones.iniciar()
+
+
+@app.on_event("shutdown")
+async def detener_tracking():
+    """
+    Guarda las posiciones pendientes antes de detener el worker
+    """
+    await tracking.detener()
+
+
+@app.on_event("shutdown")
+async def detener_catalogo():
+    """
+    Detiene la publicación en segundo plano del catálogo
+    """
+    await catalogo.detener()
+
+
+@app.on_event("shutdown")
+async def detener_snapshots():
+    """
+    Detiene la generación programada de snapshots
+    """
+    await asignaciones.detener()
+
+
 @app.on_event("shutdown")
 def on_shutdown():
     """
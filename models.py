@@ -2,6 +2,7 @@ from datetime import date, datetime, time
 from decimal import Decimal
 from typing import Optional
 
+from sqlalchemy import Column, Text
 from sqlmodel import Field, SQLModel
 
 
@@ -93,3 +94,12 @@ class CoordenadaUsuario(SQLModel, table=True):
     longitud_actual: Optional[Decimal] = None
     codigo_qr: Optional[str] = Field(default=None, max_length=255)
     verificador: int = Field(default=0)
+
+
+class RondasAsignadasSnapshot(SQLModel, table=True):
+    __tablename__ = "rondas_asignadas_snapshot"
+
+    id_usuario: int = Field(foreign_key="usuarios.id_usuario", primary_key=True)
+    fecha: date = Field(primary_key=True)
+    payload: str = Field(sa_column=Column(Text, nullable=False))
+    fecha_generacion: Optional[datetime] = Field(default_factory=datetime.now)
@@ -2,10 +2,16 @@ import logging
 from datetime import datetime
 from decimal import Decimal
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session
-
-from database import get_session
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlmodel import Session, select
+
+from asignaciones import leer_rondas_asignadas
+from database import (
+    ULTIMA_ESCRITURA_HEADER,
+    get_read_session,
+    get_session,
+    marca_escritura,
+)
 from models import CoordenadaUsuario, RondaUsuario
 from schemas import SubirRondaRequest, SubirRondaResponse
 
@@ -14,15 +20,20 @@ logger = logging.getLogger(__name__)
 
 
 @router.post("/subir", response_model=SubirRondaResponse)
-def subir_ronda(request: SubirRondaRequest, session: Session = Depends(get_session)):
+def subir_ronda(
+    request: SubirRondaRequest,
+    response: Response,
+    session: Session = Depends(get_session),
+):
     """
     Recibe una ronda completada desde Flutter y la guarda en MySQL
 
     Flujo:
     1. Convierte fechas de Flutter (strings) a tipos MySQL (date, time)
-    2. Guarda en rondas_usuarios
-    3. Guarda todas las coordenadas en coordenadas_usuarios
-    4. Retorna el ID de la ronda creada
+    2. Guarda en rondas_usuarios (o cierra la ronda creada por el tracking en vivo)
+    3. Guarda las coordenadas en coordenadas_usuarios (sin repetir las ya recibidas en vivo)
+    4. Retorna el ID de la ronda creada y el header X-Ultima-Escritura,
+       que el cliente reenvía en login/asignadas para leer del primario
     """
     try:
         # 1. CONVERTIR FECHAS
@@ -30,32 +41,65 @@ def subir_ronda(request: SubirRondaRequest, session: Session = Depends(get_sessi
         hora_inicio = datetime.strptime(request.hora_inicio, "%Y-%m-%dT%H:%M:%S").time()
         hora_final = datetime.strptime(request.hora_final, "%Y-%m-%dT%H:%M:%S").time()
 
-        # 2. CREAR RONDA_USUARIO
-        nueva_ronda = RondaUsuario(
-            id_usuario=request.id_usuario,
-            id_ronda_asignada=request.id_ronda_asignada,
-            fecha=fecha,
-            hora_inicio=hora_inicio,
-            hora_final=hora_final,
-            sincronizada=1,
-        )
+        # 2. CREAR RONDA_USUARIO (o cerrar la que se abrió en vivo)
+        coordenadas_existentes = set()
+
+        if request.id_ronda_usuario is not None:
+            # Bloquea la fila: espera a que termine un lote del tracking en curso
+            # y hace que los lotes siguientes descarten esta ronda ya subida
+            nueva_ronda = session.get(
+                RondaUsuario, request.id_ronda_usuario, with_for_update=True
+            )
+
+            if (
+                not nueva_ronda
+                or nueva_ronda.id_usuario != request.id_usuario
+                or nueva_ronda.id_ronda_asignada != request.id_ronda_asignada
+            ):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Ronda no encontrada",
+                )
+
+            nueva_ronda.hora_inicio = hora_inicio
+            nueva_ronda.hora_final = hora_final
+            nueva_ronda.sincronizada = 1
+
+            statement = select(
+                CoordenadaUsuario.hora_actual, CoordenadaUsuario.codigo_qr
+            ).where(CoordenadaUsuario.id_ronda_usuario == request.id_ronda_usuario)
+            coordenadas_existentes = set(session.exec(statement).all())
+        else:
+            nueva_ronda = RondaUsuario(
+                id_usuario=request.id_usuario,
+                id_ronda_asignada=request.id_ronda_asignada,
+                fecha=fecha,
+                hora_inicio=hora_inicio,
+                hora_final=hora_final,
+                sincronizada=1,
+            )
 
         session.add(nueva_ronda)
         session.commit()
         session.refresh(nueva_ronda)
 
+        accion = "cerrada" if request.id_ronda_usuario is not None else "creada"
         logger.info(
-            f"Ronda creada - ID: {nueva_ronda.id_ronda_usuario}, "
-            f"Usuario: {request.id_usuario}, "
-            f"Coordenadas: {len(request.coordenadas)}"
+            f"Ronda {accion} - ID: {nueva_ronda.id_ronda_usuario}, "
+            f"Usuario: {request.id_usuario}"
         )
 
         # 3. GUARDAR COORDENADAS
+        guardadas = 0
         for coord_data in request.coordenadas:
             hora_actual = datetime.strptime(
                 coord_data.hora_actual, "%Y-%m-%dT%H:%M:%S"
             ).time()
 
+            # Ya guardada por el tracking en vivo
+            if (hora_actual, coord_data.codigo_qr) in coordenadas_existentes:
+                continue
+
             coordenada = CoordenadaUsuario(
                 id_ronda_usuario=nueva_ronda.id_ronda_usuario,
                 hora_actual=hora_actual,
@@ -74,17 +118,25 @@ def subir_ronda(request: SubirRondaRequest, session: Session = Depends(get_sessi
             )
 
             session.add(coordenada)
+            guardadas += 1
 
         session.commit()
+        response.headers[ULTIMA_ESCRITURA_HEADER] = marca_escritura()
 
-        logger.info(f"Ronda {nueva_ronda.id_ronda_usuario} guardada exitosamente")
+        logger.info(
+            f"Ronda {nueva_ronda.id_ronda_usuario} guardada exitosamente - "
+            f"Coordenadas: {guardadas}"
+        )
 
         return SubirRondaResponse(
             success=True,
-            message=f"Ronda guardada exitosamente con {len(request.coordenadas)} coordenadas",
+            message=f"Ronda guardada exitosamente con {guardadas} coordenadas",
             id_ronda_usuario=nueva_ronda.id_ronda_usuario,
         )
 
+    except HTTPException:
+        raise
+
     except ValueError as e:
         logger.warning(f"Formato de fecha inválido en subir_ronda: {str(e)}")
         raise HTTPException(
@@ -102,27 +154,16 @@ def subir_ronda(request: SubirRondaRequest, session: Session = Depends(get_sessi
 
 
 @router.get("/asignadas/{id_usuario}")
-def obtener_rondas_asignadas(id_usuario: int, session: Session = Depends(get_session)):
+def obtener_rondas_asignadas(
+    id_usuario: int, session: Session = Depends(get_read_session)
+):
     """
     Obtiene las rondas asignadas de un usuario (hoy y mañana)
     Útil si se quiere actualizar rondas sin hacer login completo
     """
     try:
-        from datetime import date, timedelta
-
-        from sqlmodel import select
-
-        from models import RondaAsignada
-
-        hoy = date.today()
-        manana = hoy + timedelta(days=1)
-
-        statement = select(RondaAsignada).where(
-            RondaAsignada.id_usuario == id_usuario,
-            RondaAsignada.fecha_de_ejecucion.in_([hoy, manana]),
-        )
-
-        rondas = session.exec(statement).all()
+        # Snapshot precalculado del día (una sola fila por usuario)
+        rondas = leer_rondas_asignadas(session, id_usuario)
 
         logger.info(
             f"Usuario {id_usuario} consultó rondas asignadas - Total: {len(rondas)}"
@@ -132,9 +173,9 @@ def obtener_rondas_asignadas(id_usuario: int, session: Session = Depends(get_ses
             "total": len(rondas),
             "rondas": [
                 {
-                    "id_ronda_asignada": r.id_ronda_asignada,
-                    "fecha": r.fecha_de_ejecucion.strftime("%Y-%m-%d"),
-                    "hora": r.hora_de_ejecucion.strftime("%H:%M:%S"),
+                    "id_ronda_asignada": r["id_ronda_asignada"],
+                    "fecha": r["fecha_de_ejecucion"],
+                    "hora": r["hora_de_ejecucion"].split("T")[1],
                 }
                 for r in rondas
             ],
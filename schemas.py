@@ -78,6 +78,7 @@ class SubirRondaRequest(BaseModel):
     hora_inicio: str  # Formato: "2025-11-03T14:30:00"
     hora_final: str  # Formato: "2025-11-03T16:30:00"
     coordenadas: List[CoordenadaUsuarioRequest]
+    id_ronda_usuario: Optional[int] = None  # Ronda creada por /api/tracking/guardia
 
 
 class SubirRondaResponse(BaseModel):
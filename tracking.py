@@ -0,0 +1,471 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+from sqlalchemy import func, insert, update
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+
+from database import engine
+from models import CoordenadaUsuario, RondaAsignada, RondaUsuario
+from schemas import CoordenadaUsuarioRequest
+
+router = APIRouter(prefix="/api/tracking", tags=["Tracking"])
+logger = logging.getLogger(__name__)
+
+# Mensajes que se guardan por supervisor antes de descartar los más viejos
+TRACKING_BUFFER = int(os.getenv("TRACKING_BUFFER", "100"))
+
+# Cada cuánto se guardan en BD las posiciones recibidas (segundos)
+TRACKING_FLUSH_SECONDS = float(os.getenv("TRACKING_FLUSH_SECONDS", "2"))
+
+# Tamaño de lote que fuerza un guardado antes de que termine el intervalo
+TRACKING_MAX_LOTE = int(os.getenv("TRACKING_MAX_LOTE", "500"))
+
+# Minutos sin posiciones tras los que una ronda en vivo no subida se cierra
+TRACKING_INACTIVIDAD_MINUTOS = float(os.getenv("TRACKING_INACTIVIDAD_MINUTOS", "120"))
+
+# Cada cuánto se buscan rondas en vivo abandonadas (segundos)
+TRACKING_CIERRE_SECONDS = float(os.getenv("TRACKING_CIERRE_SECONDS", "600"))
+
+TEMA_TODAS = "todas"
+
+
+def tema_ruta(id_ruta: int) -> str:
+    return f"ruta:{id_ruta}"
+
+
+class Suscriptor:
+    """
+    Buffer acotado de un supervisor
+    Si el cliente es lento se descartan los mensajes más viejos
+    """
+
+    def __init__(self, max_mensajes: int):
+        self.mensajes: Deque[str] = deque(maxlen=max_mensajes)
+        self.descartados = 0
+        self._evento = asyncio.Event()
+
+    def entregar(self, mensaje: str) -> None:
+        if len(self.mensajes) == self.mensajes.maxlen:
+            self.descartados += 1
+        self.mensajes.append(mensaje)
+        self._evento.set()
+
+    async def siguiente(self) -> str:
+        while not self.mensajes:
+            self._evento.clear()
+            await self._evento.wait()
+        return self.mensajes.popleft()
+
+
+class BrokerPosiciones:
+    """
+    Fan-out en memoria de posiciones por tema (ruta o todas)
+    Vive en el event loop del worker, no necesita locks
+
+    El fan-out es por proceso: con varios workers un supervisor solo recibe
+    las posiciones de los guardias conectados a su mismo worker. Para ver a
+    todos los guardias hay que correr un solo worker para /api/tracking o
+    reemplazar este broker por uno compartido (por ejemplo Redis pub/sub)
+    """
+
+    def __init__(self, max_mensajes: int):
+        self._max_mensajes = max_mensajes
+        self._temas: Dict[str, Set[Suscriptor]] = {}
+
+    def suscribir(self, tema: str) -> Suscriptor:
+        suscriptor = Suscriptor(self._max_mensajes)
+        self._temas.setdefault(tema, set()).add(suscriptor)
+        return suscriptor
+
+    def desuscribir(self, tema: str, suscriptor: Suscriptor) -> None:
+        suscriptores = self._temas.get(tema)
+        if suscriptores is None:
+            return
+        suscriptores.discard(suscriptor)
+        if not suscriptores:
+            del self._temas[tema]
+
+    def publicar(self, tema: str, mensaje: str) -> None:
+        for suscriptor in self._temas.get(tema, ()):
+            suscriptor.entregar(mensaje)
+
+
+class PersistenciaPosiciones:
+    """
+    Acumula posiciones y las inserta en coordenadas_usuarios por lotes
+    """
+
+    def __init__(self, intervalo: float, max_lote: int):
+        self._intervalo = intervalo
+        self._max_lote = max_lote
+        self._pendientes: List[dict] = []
+        self._lote_lleno = asyncio.Event()
+        self._guardando = asyncio.Lock()
+        self._tarea: Optional[asyncio.Task] = None
+
+    def agregar(self, fila: dict) -> None:
+        self._pendientes.append(fila)
+        if len(self._pendientes) >= self._max_lote:
+            self._lote_lleno.set()
+
+    async def vaciar(self) -> None:
+        """
+        Guarda lo pendiente; si hay un lote en curso espera a que termine,
+        así al retornar todo lo recibido hasta ahora ya está en la BD
+        """
+        async with self._guardando:
+            if not self._pendientes:
+                return
+
+            filas, self._pendientes = self._pendientes, []
+            try:
+                await run_in_threadpool(_insertar_lote, filas)
+            except Exception as e:
+                logger.error(
+                    f"Error al guardar lote de posiciones: {str(e)}", exc_info=True
+                )
+                # Reintentar en el siguiente ciclo sin crecer sin límite
+                if len(self._pendientes) < self._max_lote * 10:
+                    self._pendientes = filas + self._pendientes
+
+    async def _ejecutar(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._lote_lleno.wait(), self._intervalo)
+            except asyncio.TimeoutError:
+                pass
+            self._lote_lleno.clear()
+            await self.vaciar()
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        await self.vaciar()
+
+
+broker = BrokerPosiciones(TRACKING_BUFFER)
+persistencia = PersistenciaPosiciones(TRACKING_FLUSH_SECONDS, TRACKING_MAX_LOTE)
+
+
+def _insertar_lote(filas: List[dict]) -> None:
+    """
+    Inserción masiva (executemany) de posiciones
+
+    Bloquea las filas de rondas_usuarios del lote (igual que subir_ronda) y
+    descarta las posiciones de rondas ya subidas: esas ya llegaron completas
+    en la subida y guardarlas otra vez las duplicaría
+    """
+    ids_rondas = sorted({fila["id_ronda_usuario"] for fila in filas})
+
+    with Session(engine) as session:
+        statement = (
+            select(RondaUsuario.id_ronda_usuario)
+            .where(
+                RondaUsuario.id_ronda_usuario.in_(ids_rondas),
+                RondaUsuario.sincronizada == 0,
+            )
+            .order_by(RondaUsuario.id_ronda_usuario)
+            .with_for_update()
+        )
+        abiertas = set(session.exec(statement).all())
+
+        filas = [fila for fila in filas if fila["id_ronda_usuario"] in abiertas]
+        if filas:
+            session.execute(insert(CoordenadaUsuario), filas)
+        session.commit()
+
+    if filas:
+        logger.info(f"Lote de {len(filas)} posiciones guardado")
+
+
+def _iniciar_ronda_en_vivo(
+    id_usuario: int, id_ronda_asignada: int, id_ronda_usuario: Optional[int]
+) -> Optional[Tuple[int, int]]:
+    """
+    Valida la ronda asignada y crea (o retoma) la ronda_usuario en curso
+    Retorna (id_ronda_usuario, id_ruta) o None si no es válida
+    """
+    with Session(engine) as session:
+        asignada = session.get(RondaAsignada, id_ronda_asignada)
+        if not asignada or asignada.id_usuario != id_usuario:
+            return None
+
+        # Reconexión: retomar la ronda ya creada
+        if id_ronda_usuario is not None:
+            ronda = session.get(RondaUsuario, id_ronda_usuario)
+            if (
+                not ronda
+                or ronda.id_usuario != id_usuario
+                or ronda.id_ronda_asignada != id_ronda_asignada
+                or ronda.sincronizada
+                or ronda.hora_final is not None
+            ):
+                return None
+            return ronda.id_ronda_usuario, asignada.id_ruta
+
+        ronda = RondaUsuario(
+            id_usuario=id_usuario,
+            id_ronda_asignada=id_ronda_asignada,
+            fecha=date.today(),
+            hora_inicio=datetime.now().time().replace(microsecond=0),
+            sincronizada=0,
+        )
+        id_ruta = asignada.id_ruta
+        session.add(ronda)
+        session.commit()
+        session.refresh(ronda)
+
+    return ronda.id_ronda_usuario, id_ruta
+
+
+def cerrar_rondas_inactivas(ahora: Optional[datetime] = None) -> int:
+    """
+    Cierra las rondas en vivo que nunca se subieron y llevan más de
+    TRACKING_INACTIVIDAD_MINUTOS sin posiciones
+
+    hora_final queda en la última posición recibida (o en hora_inicio) y
+    sincronizada sigue en 0; retorna cuántas rondas se cerraron
+    """
+    ahora = ahora or datetime.now()
+    limite = ahora - timedelta(minutes=TRACKING_INACTIVIDAD_MINUTOS)
+
+    with Session(engine) as session:
+        statement = (
+            select(
+                RondaUsuario.id_ronda_usuario,
+                RondaUsuario.fecha,
+                RondaUsuario.hora_inicio,
+                func.max(CoordenadaUsuario.hora_actual),
+            )
+            .outerjoin(
+                CoordenadaUsuario,
+                CoordenadaUsuario.id_ronda_usuario == RondaUsuario.id_ronda_usuario,
+            )
+            .where(RondaUsuario.sincronizada == 0, RondaUsuario.hora_final.is_(None))
+            .group_by(
+                RondaUsuario.id_ronda_usuario,
+                RondaUsuario.fecha,
+                RondaUsuario.hora_inicio,
+            )
+        )
+
+        abiertas = session.exec(statement).all()
+
+        cerradas = 0
+        for id_ronda_usuario, fecha, hora_inicio, ultima_hora in abiertas:
+            ultima_hora = ultima_hora or hora_inicio
+            ultima = datetime.combine(fecha, ultima_hora)
+            # La ronda pasó de la medianoche
+            if ultima_hora < hora_inicio:
+                ultima += timedelta(days=1)
+            if ultima >= limite:
+                continue
+
+            # Solo si sigue abierta: subir_ronda pudo cerrarla mientras tanto
+            resultado = session.execute(
+                update(RondaUsuario)
+                .where(
+                    RondaUsuario.id_ronda_usuario == id_ronda_usuario,
+                    RondaUsuario.sincronizada == 0,
+                    RondaUsuario.hora_final.is_(None),
+                )
+                .values(hora_final=ultima_hora)
+            )
+            cerradas += resultado.rowcount
+
+        session.commit()
+
+    if cerradas:
+        logger.info(f"Rondas en vivo cerradas por inactividad: {cerradas}")
+    return cerradas
+
+
+async def _programar_cierre() -> None:
+    while True:
+        try:
+            await run_in_threadpool(cerrar_rondas_inactivas)
+        except Exception as e:
+            logger.error(f"Error al cerrar rondas inactivas: {str(e)}", exc_info=True)
+        await asyncio.sleep(TRACKING_CIERRE_SECONDS)
+
+
+_tarea_cierre: Optional[asyncio.Task] = None
+
+
+def iniciar() -> None:
+    global _tarea_cierre
+    persistencia.iniciar()
+    if _tarea_cierre is None:
+        _tarea_cierre = asyncio.create_task(_programar_cierre())
+
+
+async def detener() -> None:
+    global _tarea_cierre
+    if _tarea_cierre is not None:
+        _tarea_cierre.cancel()
+        try:
+            await _tarea_cierre
+        except asyncio.CancelledError:
+            pass
+        _tarea_cierre = None
+    await persistencia.detener()
+
+
+@router.websocket("/guardia")
+async def stream_guardia(
+    websocket: WebSocket,
+    id_usuario: int,
+    id_ronda_asignada: int,
+    id_ronda_usuario: Optional[int] = None,
+):
+    """
+    Canal del dispositivo del guardia durante una ronda activa
+
+    Flujo:
+    1. Crea la ronda en curso (o la retoma si se envía id_ronda_usuario)
+    2. Responde {"id_ronda_usuario": ...}
+    3. Recibe posiciones con el formato de CoordenadaUsuarioRequest
+    4. Las reenvía a los supervisores y las guarda por lotes
+
+    Al terminar, subir con /api/rondas/subir enviando id_ronda_usuario
+
+    Mientras no se suba, la ronda queda con sincronizada=0. Si no llegan
+    posiciones en TRACKING_INACTIVIDAD_MINUTOS se cierra (hora_final) sin
+    marcarla sincronizada, así que las consultas de rondas completadas
+    deben filtrar por sincronizada=1
+    """
+    try:
+        resultado = await run_in_threadpool(
+            _iniciar_ronda_en_vivo, id_usuario, id_ronda_asignada, id_ronda_usuario
+        )
+    except Exception as e:
+        logger.error(f"Error al iniciar ronda en vivo: {str(e)}", exc_info=True)
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+
+    if resultado is None:
+        logger.warning(
+            f"Tracking rechazado - Usuario: {id_usuario}, "
+            f"Ronda asignada: {id_ronda_asignada}"
+        )
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    id_ronda_usuario, id_ruta = resultado
+    temas = (tema_ruta(id_ruta), TEMA_TODAS)
+
+    await websocket.accept()
+    await websocket.send_json({"id_ronda_usuario": id_ronda_usuario})
+
+    logger.info(
+        f"Tracking iniciado - Ronda: {id_ronda_usuario}, Usuario: {id_usuario}"
+    )
+
+    try:
+        while True:
+            data = await websocket.receive_text()
+
+            try:
+                posicion = CoordenadaUsuarioRequest.model_validate_json(data)
+                hora_actual = datetime.strptime(
+                    posicion.hora_actual, "%Y-%m-%dT%H:%M:%S"
+                ).time()
+            except (ValidationError, ValueError):
+                await websocket.send_json({"error": "Posición inválida"})
+                continue
+
+            # Serializar una sola vez para todos los supervisores
+            mensaje = json.dumps(
+                {
+                    "id_usuario": id_usuario,
+                    "id_ronda_usuario": id_ronda_usuario,
+                    "id_ruta": id_ruta,
+                    "hora_actual": posicion.hora_actual,
+                    "latitud": posicion.latitud_actual,
+                    "longitud": posicion.longitud_actual,
+                    "codigo_qr": posicion.codigo_qr,
+                    "verificador": posicion.verificador,
+                }
+            )
+            for tema in temas:
+                broker.publicar(tema, mensaje)
+
+            persistencia.agregar(
+                {
+                    "id_ronda_usuario": id_ronda_usuario,
+                    "hora_actual": hora_actual,
+                    "latitud_actual": (
+                        Decimal(str(posicion.latitud_actual))
+                        if posicion.latitud_actual is not None
+                        else None
+                    ),
+                    "longitud_actual": (
+                        Decimal(str(posicion.longitud_actual))
+                        if posicion.longitud_actual is not None
+                        else None
+                    ),
+                    "codigo_qr": posicion.codigo_qr,
+                    "verificador": 1 if posicion.verificador else 0,
+                }
+            )
+
+    except WebSocketDisconnect:
+        logger.info(f"Tracking terminado - Ronda: {id_ronda_usuario}")
+
+    finally:
+        # Guardar lo pendiente antes de que el dispositivo suba la ronda
+        await persistencia.vaciar()
+
+
+@router.websocket("/supervisor")
+async def stream_supervisor(websocket: WebSocket, id_ruta: Optional[int] = None):
+    """
+    Canal de supervisores: posiciones en vivo de una ruta (o de todas)
+    Si el cliente no alcanza a leer, se descartan las posiciones más viejas
+    """
+    tema = tema_ruta(id_ruta) if id_ruta is not None else TEMA_TODAS
+
+    await websocket.accept()
+    suscriptor = broker.suscribir(tema)
+
+    async def enviar():
+        while True:
+            await websocket.send_text(await suscriptor.siguiente())
+
+    async def recibir():
+        # Solo sirve para detectar la desconexión del cliente
+        while True:
+            await websocket.receive_text()
+
+    tareas = [asyncio.create_task(enviar()), asyncio.create_task(recibir())]
+    try:
+        await asyncio.wait(tareas, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+        # Recuperar las excepciones (desconexión) y esperar las canceladas
+        await asyncio.gather(*tareas, return_exceptions=True)
+        broker.desuscribir(tema, suscriptor)
+
+        if suscriptor.descartados:
+            logger.warning(
+                f"Supervisor de {tema} descartó {suscriptor.descartados} posiciones"
+            )